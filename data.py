@@ -15,35 +15,95 @@
 # Copyright Plus or Minus Five, 2012
 
 from __future__ import division
-from math import log, ceil
+from fractions import gcd
+from string import maketrans
+import binascii
 import re
 
+# Patterns used to split and canonicalize Phonetic-encoded strings.
+_WORD = re.compile(r'\w+')
+_NON_WORD = re.compile(r'[\W_]')
+
+
+def base16Encode(byteString):
+	'''Return the standard Base16 encoding of `byteString` as a single line.
+	This is the fast path behind `Base16.encode()`, for callers that encode
+	many short strings and don't need a custom alphabet or line breaks.
+	
+	>>> base16Encode('\xde\xad\xbe\xef')
+	'DEADBEEF'
+	'''
+	return binascii.hexlify(byteString).upper()
+
+
+def base64Encode(byteString):
+	'''Return the standard Base64 encoding of `byteString` as a single line.
+	This is the fast path behind `Base64.encode()`.
+	
+	>>> base64Encode('Hello, world!')
+	'SGVsbG8sIHdvcmxkIQ=='
+	'''
+	return binascii.b2a_base64(byteString)[:-1]
+
 
 class Data(object):
 	'''The `Data` class is an opaque data object that uses a byte string as a
 	backing store. The class provides functions to manipulate data objects and
 	generate string representations
 	
+	The bytes are kept in a `bytearray`, so appending to a data object or
+	replacing a range of its bytes happens in place. The `bytes` property
+	returns a copy of the contents as an immutable byte string.
 	'''
 	
 	def __init__(self, string, encoding=None):
 		if encoding:
 			self.bytes = encoding.decode(string)
 		else:
-			# assert(isinstance(string, str) or isinstance(string, int) or isinstance()
-			if isinstance(string, str):
+			if isinstance(string, (bytes, bytearray, memoryview)):
 				self.bytes = string
 			elif isinstance(string, int) or isinstance(string, long):
 				num = string
 				if num < 0:
 					raise ValueError('Data constructor requires a positive integer')
-				byteLen = int(ceil(num.bit_length() / 8))
-				self.bytes = ''.join(chr(num >> (8 * i) & 0xFF) for i in reversed(range(byteLen)))
+				digits = '{0:x}'.format(num) if num else ''
+				self.bytes = binascii.unhexlify('0' * (len(digits) % 2) + digits)
 			else:
-				raise TypeError('Data constructor requires a byte string, int, or long')
+				raise TypeError(
+					'Data constructor requires a byte string, bytearray, int, or long'
+				)
 	
-	def stringWithEncoding(self, encoding, **kwargs):
-		return encoding.encode(self.bytes, **kwargs)
+	@classmethod
+	def _wrap(clz, buffer):
+		'''Return a data object that takes ownership of a `bytearray` without
+		copying it or going through the checks in the constructor.
+		'''
+		data = clz.__new__(clz)
+		data._buffer = buffer
+		return data
+	
+	@property
+	def bytes(self):
+		return str(self._buffer)
+	
+	@bytes.setter
+	def bytes(self, value):
+		self._buffer = bytearray(value)
+	
+	def stringWithEncoding(self, encoding, stream=False, **kwargs):
+		# The encoders in this module accept anything that supports the buffer
+		# interface, so they can read the bytes in place rather than from a
+		# copy. Encoders defined elsewhere are given an immutable byte string.
+		methods = (encoding.encode, encoding.iterEncode)
+		
+		if all(method.__module__ == __name__ for method in methods):
+			byteString = buffer(self._buffer)
+		else:
+			byteString = self.bytes
+		
+		if stream:
+			return encoding.iterEncode(byteString, **kwargs)
+		return encoding.encode(byteString, **kwargs)
 	
 	def __str__(self):
 		return self.stringWithEncoding(Base64)
@@ -59,40 +119,93 @@ class Data(object):
 		return self.stringWithEncoding(Base16)
 	
 	def __add__(self, other):
-		return Data(self.bytes + other.bytes)
+		return self._wrap(self._buffer + other._buffer)
 	
 	__concat__ = __add__
 	
 	def __iadd__(self, other):
-		self.bytes += other.bytes
+		self._buffer.extend(other._buffer)
 		return self
 	
 	def __contains__(self, item):
-		return item.bytes in self.bytes
+		return item._buffer in self._buffer
 	
 	def __eq__(self, other):
-		return self.bytes == other.bytes
+		return self._buffer == other._buffer
 	
 	def __len__(self):
-		return len(self.bytes)
+		return len(self._buffer)
 	
 	def __getitem__(self, key):
-		return Data(self.bytes[key])
+		if isinstance(key, slice):
+			return self._wrap(self._buffer[key])
+		else:
+			# Indexing a bytearray returns an int, not a one-byte string
+			return self._wrap(bytearray((self._buffer[key],)))
 	
 	def __setitem__(self, key, value):
 		if isinstance(key, slice):
-			start, stop, step = key.indices(len(self.bytes))
+			start, stop, step = key.indices(len(self._buffer))
 			
 			if step != 1:
 				raise TypeError('cannot modify data contents with a stride')
 			
-			self.bytes = self.bytes[:start] + value.bytes + self.bytes[stop:]
+			self._buffer[start:stop] = value._buffer
 		elif isinstance(key, int):
-			self.bytes = self.bytes[:key] + value.bytes + self.bytes[key+1:]
+			if key < 0:
+				key += len(self._buffer)
+			
+			self._buffer[key:key + 1] = value._buffer
 		else:
 			raise TypeError('data indices must be integers or slices')
 
 
+class EncodingType(type):
+	'''Metaclass for `Encoding` classes. Lookup tables that depend only on a
+	class's `alphabet` and `base` are computed once, when the class is created,
+	rather than on every call to `encode()` or `decode()`.
+	'''
+	
+	def __init__(clz, name, bases, attrs):
+		super(EncodingType, clz).__init__(name, bases, attrs)
+		
+		# Each character carries `floor(log2(base))` bits, so bases that aren't
+		# powers of two only use the first `2 ** width` alphabet characters.
+		if clz.base > 1:
+			clz._width = clz.base.bit_length() - 1
+			clz._bitStrings = clz._makeBitStrings(clz._width)
+			clz._encodeTable = dict(zip(clz._bitStrings, clz.alphabet))
+		else:
+			clz._width = None
+			clz._bitStrings = None
+			clz._encodeTable = None
+		
+		clz._decodeTable = clz._makeDecodeTable(clz.alphabet)
+		
+		# Replacements that substitute or delete single characters can all
+		# be applied in one pass with `str.translate`.
+		replacements = clz.replacements.items()
+		
+		if all(len(k) == 1 and len(v) <= 1 for k, v in replacements):
+			substitutions = [(k, v) for k, v in replacements if v]
+			
+			# A table of `None` lets `str.translate` skip the mapping step
+			# entirely when the replacements only delete characters.
+			if substitutions:
+				table = maketrans(
+					''.join(k for k, v in substitutions),
+					''.join(v for k, v in substitutions)
+				)
+			else:
+				table = None
+			
+			clz._translation = (
+				table, ''.join(k for k, v in replacements if not v)
+			)
+		else:
+			clz._translation = None
+
+
 class Encoding(object):
 	'''The `Encoding` class is an abstract base for various encoding types.
 	It provides generic left-to-right bitwise conversion algorithms for its
@@ -108,10 +221,15 @@ class Encoding(object):
 	NotImplementedError: Encoding classes cannot be instantiated. ...
 	'''
 	
+	__metaclass__ = EncodingType
+	
 	alphabet = ''
 	base = 0
 	replacements = {}
 	
+	# Cache of `str.translate` tables for custom alphabets
+	_translationTables = {}
+	
 	def __init__(self):
 		raise NotImplementedError(
 			'Encoding classes cannot be instantiated. Use '
@@ -120,35 +238,52 @@ class Encoding(object):
 	
 	@classmethod
 	def decode(clz, string, alphabet=None, ignoreinvalidchars=False):
-		if not alphabet:
-			alphabet = clz.alphabet
-		
-		width = int(log(clz.base, 2))
+		if alphabet:
+			table = clz._makeDecodeTable(alphabet)
+		else:
+			table = clz._decodeTable
 		
-		bytes = ''
-		window = 0
-		winOffset = 16 - width
+		string = clz._canonicalRepr(string)
 		
-		for ch in clz._canonicalRepr(string):
-			try:
-				window |= (alphabet.index(ch) << winOffset)
-			except ValueError:
+		# Every step below runs in C. The input is translated into a string
+		# of alphabet indices, each index is replaced with its binary digits,
+		# and the resulting bit string is parsed as a single integer.
+		if isinstance(table, dict):
+			# Alphabets with characters above U+00FF can't be used with
+			# `str.translate`, so each character is looked up on its own.
+			indices = map(table.get, string)
+			
+			if None in indices:
+				raise ValueError('Illegal character in input string')
+		else:
+			indices = string.translate(table)
+			
+			if '\xff' in indices:
 				raise ValueError('Illegal character in input string')
-			winOffset -= width
 			
-			if winOffset <= (8 - width):
-				bytes += chr((window & 0xFF00) >> 8)
-				window = (window & 0xFF) << 8
-				winOffset += 8
+			indices = bytearray(indices)
 		
-		if window:
+		try:
+			bits = ''.join(map(clz._bitStrings.__getitem__, indices))
+		except IndexError:
+			# The character is in the alphabet but beyond the last one that
+			# fits in `width` bits.
+			raise ValueError('Illegal character in input string')
+		
+		spare = len(bits) % 8
+		
+		if '1' in bits[len(bits) - spare:]:
 			# The padding was wrong, so we throw a tantrum
 			raise ValueError('Illegal input string')
 		
-		# We assembled the byte string in reverse because it's faster
-		# to append to a string than to prepend in Python. Reversing a
-		# string, on the other hand is Super Fast (TM).
-		return bytes
+		bits = bits[:len(bits) - spare]
+		
+		if not bits:
+			return ''
+		
+		return binascii.unhexlify(
+			'{0:0{1}x}'.format(int(bits, 2), len(bits) // 4)
+		)
 	
 	@classmethod
 	def encode(
@@ -158,54 +293,152 @@ class Encoding(object):
 		linelength=64,
 		lineseparator='\r\n'
 	):
-		if not alphabet:
-			alphabet = clz.alphabet
+		if not byteString:
+			return ''
+		
+		width = clz._width
+		bitCount = len(byteString) * 8
+		charCount = (bitCount + width - 1) // width
 		
-		width = int(log(clz.base, 2))
-		string = ''
-		lineCharCount = 0
+		# Convert the whole byte string into a single integer, zero-pad it on
+		# the right to a whole number of characters and format it as a string
+		# of binary digits. All three steps run in C, so the only Python-level
+		# work is looking up one alphabet character for every `width` bits.
+		number = int(binascii.hexlify(byteString), 16)
+		number <<= charCount * width - bitCount
+		bits = format(number, 'b').zfill(charCount * width)
 		
-		window = 0
+		if alphabet:
+			digits = dict(zip(clz._bitStrings, alphabet))
+		else:
+			digits = clz._encodeTable
 		
-		maskOffset = 8 - width
-		mask = (2 ** width - 1) << maskOffset
+		string = ''.join([
+			digits[bits[i:i + width]] for i in xrange(0, len(bits), width)
+		])
 		
-		for ch in byteString:
-			window |= ord(ch)
-			
-			while maskOffset >= 0:
-				string += alphabet[(window & mask) >> maskOffset]
-				lineCharCount += 1
-				
-				if linelength and lineCharCount == linelength:
-					string += lineseparator
-					lineCharCount = 0
-				
-				if maskOffset - width >= 0:
-					mask >>= width
-					maskOffset -= width
-				else:
-					break
-			
-			window &= 0xFF
-			window <<= 8
-			mask <<= 8 - width
-			maskOffset += 8 - width
+		return clz._breakLines(string, linelength, lineseparator)
+	
+	@classmethod
+	def iterEncode(clz, byteString, chunksize=49152, **kwargs):
+		'''Generate the encoded representation of `byteString` in pieces of
+		roughly `chunksize` input bytes, so the whole encoded string never
+		has to be held in memory at once. Joining the pieces gives the same
+		result as calling `encode()` with the same keyword arguments.
 		
-		if maskOffset > 8 - width:
-			# If there are unencoded characters to the right of the mask, shift
-			# the mask all the way right and shift the window the remainder of
-			# the mask width to encode a zero-padded character at the end.
-			string += alphabet[(window & mask) >> maskOffset]
+		Chunks are aligned so each one ends on a character boundary and, when
+		the output is broken into lines, on a line boundary. Encodings whose
+		base is not a power of two produce a single piece. Subclasses whose
+		`encode()` can't be applied piecewise (because it compresses its
+		input, for example) should override this method.
+		'''
+		if clz.base < 2 or clz.base & (clz.base - 1):
+			yield clz.encode(byteString, **kwargs)
+			return
 		
-		return string
+		width = clz._width
+		
+		# These defaults match the keyword arguments to `encode()`.
+		linelength = kwargs.get('linelength', 64)
+		lineseparator = kwargs.get('lineseparator', '\r\n')
+		
+		bits = width * (linelength or 1)
+		block = bits // gcd(bits, 8)
+		chunksize = max(chunksize // block, 1) * block
+		
+		for i in xrange(0, len(byteString), chunksize):
+			if i and linelength:
+				yield lineseparator
+			
+			yield clz.encode(byteString[i:i + chunksize], **kwargs)
 	
 	@classmethod
 	def _canonicalRepr(clz, string):
+		if isinstance(string, unicode) and not isinstance(clz._decodeTable, dict):
+			# Characters above U+00FF can't be in a byte alphabet. They raise a
+			# UnicodeEncodeError, which is a ValueError.
+			string = string.encode('latin-1')
+		
+		if clz._translation and isinstance(string, str):
+			return string.translate(*clz._translation)
+		
 		for k, v in clz.replacements.iteritems():
 			string = string.replace(k, v)
 		
 		return string
+	
+	@classmethod
+	def _translateInput(clz, string, alphabet, standard):
+		'''Return the canonical form of the input string with each character
+		of `alphabet` replaced by the character at the same index in the
+		`standard` alphabet that the C decoders in `binascii` understand.
+		'''
+		# Characters that are not in the alphabet are marked with an
+		# exclamation point, so the input is validated in the same pass.
+		table = clz._translationTable(alphabet or clz.alphabet, standard, '!')
+		string = clz._canonicalRepr(string).translate(table)
+		
+		if '!' in string:
+			raise ValueError('Illegal character in input string')
+		
+		return string
+	
+	@staticmethod
+	def _translationTable(source, target, invalid=None):
+		'''Return a `str.translate` table that maps each character of the
+		`source` alphabet onto the character at the same index in `target`.
+		If an `invalid` character is given, all other characters map onto it.
+		
+		Tables are built once for each combination of arguments, so custom
+		alphabets cost no more than the standard ones after the first call.
+		'''
+		key = (source, target, invalid)
+		
+		if key not in Encoding._translationTables:
+			if invalid:
+				others = maketrans('', '').translate(None, source)
+				source += others
+				target += invalid * len(others)
+			
+			Encoding._translationTables[key] = maketrans(source, target)
+		
+		return Encoding._translationTables[key]
+	
+	@staticmethod
+	def _breakLines(string, linelength, lineseparator):
+		'''Return the encoded string split into lines of `linelength` characters
+		joined by `lineseparator`. A `linelength` of zero disables line breaks.
+		
+		Lines are broken after the whole string is encoded, which keeps the
+		line-length bookkeeping out of the encoding loops.
+		'''
+		if not linelength or len(string) <= linelength:
+			return string
+		
+		return lineseparator.join([
+			string[i:i + linelength] for i in xrange(0, len(string), linelength)
+		])
+	
+	@staticmethod
+	def _makeBitStrings(width):
+		"Return a list of every `width`-digit binary string, in numeric order."
+		return [format(i, '0{0}b'.format(width)) for i in xrange(2 ** width)]
+	
+	@staticmethod
+	def _makeDecodeTable(alphabet):
+		'''Return a 256-entry table that maps each byte value to its index in
+		the alphabet, or to 0xFF if the character is not in the alphabet.
+		Alphabets with characters above U+00FF get a dictionary instead.
+		'''
+		if any(ord(ch) > 0xFF for ch in alphabet):
+			return {ch: index for index, ch in enumerate(alphabet)}
+		
+		table = bytearray('\xff' * 256)
+		
+		for index, ch in enumerate(alphabet):
+			table[ord(ch)] = index
+		
+		return table
 
 
 
@@ -227,6 +460,38 @@ class Base16(Encoding):
 		'S': '5',
 	}
 	
+	@classmethod
+	def decode(clz, string, alphabet=None, ignoreinvalidchars=False):
+		string = clz._translateInput(string, alphabet, Base16.alphabet)
+		
+		if len(string) % 2:
+			# A trailing half byte is only allowed if all its bits are zero
+			if string[-1] != '0':
+				raise ValueError('Illegal input string')
+			
+			string = string[:-1]
+		
+		return binascii.unhexlify(string)
+	
+	@classmethod
+	def encode(
+		clz,
+		byteString,
+		alphabet=None,
+		linelength=64,
+		lineseparator='\r\n'
+	):
+		if not alphabet:
+			alphabet = clz.alphabet
+		
+		if alphabet == Base16.alphabet:
+			string = base16Encode(byteString)
+		else:
+			table = clz._translationTable('0123456789abcdef', alphabet)
+			string = binascii.hexlify(byteString).translate(table)
+		
+		return clz._breakLines(string, linelength, lineseparator)
+	
 	@classmethod
 	def _canonicalRepr(clz, string):
 		return super(Base16, clz)._canonicalRepr(string.upper())
@@ -279,14 +544,45 @@ class Base64(Encoding):
 	}
 	
 	@classmethod
-	def encode(clz, byteString, **kwargs):
-		if 'alphabet' not in kwargs:
-			highIndexChars = kwargs.get('highindexchars', '+/')
-			kwargs['alphabet'] = clz.alphabet[:-2] + highIndexChars
+	def decode(clz, string, alphabet=None, ignoreinvalidchars=False):
+		string = clz._translateInput(string, alphabet, Base64.alphabet)
+		remainder = len(string) % 4
+		
+		if remainder:
+			# The bits to the right of the last full byte must be zero, in
+			# which case we restore the padding that `binascii` expects.
+			if Base64._decodeTable[ord(string[-1])] & (0x3F, 0x0F, 0x03)[remainder - 1]:
+				raise ValueError('Illegal input string')
+			
+			if remainder == 1:
+				string = string[:-1]
+			else:
+				string += '=' * (4 - remainder)
 		
-		string = super(Base64, clz).encode(byteString, **kwargs)
-		padding = '=' * (4 - ((len(string) % 4) or 4))
-		return string + padding
+		return binascii.a2b_base64(string)
+	
+	@classmethod
+	def encode(
+		clz,
+		byteString,
+		alphabet=None,
+		highindexchars='+/',
+		linelength=64,
+		lineseparator='\r\n'
+	):
+		if not alphabet:
+			alphabet = clz.alphabet
+			
+			if highindexchars != alphabet[-2:]:
+				alphabet = alphabet[:-2] + highindexchars
+		
+		string = base64Encode(byteString)
+		
+		if alphabet != Base64.alphabet:
+			table = clz._translationTable(Base64.alphabet, alphabet)
+			string = string.translate(table)
+		
+		return clz._breakLines(string, linelength, lineseparator)
 
 
 
@@ -318,8 +614,13 @@ class Base58(Encoding):
 	
 	@classmethod
 	def decode(clz, string):
-		width = int(log(clz.base, 2))
-		bytes = ''
+		# Map every character to its digit value in a single pass. Characters
+		# outside the alphabet come out as 0xFF.
+		values = clz._canonicalRepr(string).translate(clz._decodeTable)
+		
+		if '\xff' in values:
+			raise ValueError('Illegal character in input string')
+		
 		temp = 0
 		
 		# Because each digit is not a whole number of bits, we are using
@@ -327,32 +628,29 @@ class Base58(Encoding):
 		# this, but this is the best I can find:
 		# http://forums.xkcd.com/viewtopic.php?f=12&t=69664
 		
-		for idx, char in enumerate(clz._canonicalRepr(string)[::-1]):
-			temp += clz.alphabet.index(char) * (58 ** idx)
+		for value in bytearray(values):
+			temp = temp * 58 + value
 		
-		while temp > 0:
-			bytes += chr(temp % 256)
-			temp //= 256
+		if not temp:
+			return ''
 		
-		# We assembled the byte string in reverse because it's faster
-		# to append to a string than to prepend in Python. Reversing a
-		# string, on the other hand is Super Fast (TM).
-		return bytes[::-1]
+		# Format the number as hexadecimal and let `binascii` turn it into a
+		# byte string, padding it to an even number of digits if needed.
+		digits = '{0:x}'.format(temp)
+		return binascii.unhexlify('0' * (len(digits) % 2) + digits)
 	
 	@classmethod
 	def encode(clz, byteString):
-		width = int(log(clz.base, 2))
-		string = ''
-		temp = 0
-		
-		for idx, char in enumerate(byteString[::-1]):
-			temp += ord(char) * (256 ** idx)
+		string = []
+		temp = int(binascii.hexlify(byteString), 16) if byteString else 0
 		
 		while temp > 0:
-			string += clz.alphabet[temp % 58]
-			temp //= 58
+			temp, digit = divmod(temp, 58)
+			string.append(clz.alphabet[digit])
 		
-		return string[::-1]
+		# We assembled the digits in reverse because it's faster to append
+		# to a list than to prepend in Python.
+		return ''.join(reversed(string))
 
 
 
@@ -534,30 +832,24 @@ class Phonetic(Encoding):
 	@classmethod
 	def decode(clz, string):
 		string = clz._canonicalRepr(string)
-		wordlist = re.findall(r'\w+', string)
+		wordlist = _WORD.findall(string)
 		
-		result = ''
+		# Look up every word with a single probe. Unknown words map to None.
+		result = map(clz.wordMap.get, wordlist)
 		
-		for word in wordlist:
-			if word not in clz.wordMap:
-				raise ValueError('Illegal input string')
-			
-			result += chr(clz.wordMap[word])
+		if None in result:
+			raise ValueError('Illegal input string')
 		
-		return result
+		return str(bytearray(result))
 	
 	@classmethod
 	def encode(clz, byteString):
-		result = []
-		
-		for ch in byteString:
-			result.append(clz.wordList[ord(ch)])
-		
-		return ' '.join(result)
+		# Iterating over a bytearray yields the byte values directly.
+		return ' '.join(map(clz.wordList.__getitem__, bytearray(byteString)))
 	
 	@classmethod
 	def _canonicalRepr(clz, string):
-		return re.sub(r'[\W_]', ' ', string).lower()
+		return _NON_WORD.sub(' ', string).lower()
 
 
 
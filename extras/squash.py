@@ -1,13 +1,376 @@
 from data import Base64
+from operator import itemgetter
+
+# Run-length encoding tables. Each byte value maps to its one- or two-byte
+# encoding, and each run length from 1 to 65 maps to its prefix byte.
+_ENCODED_CHARACTERS = [
+	chr(b) if b < 127 else chr(0xE0 | b >> 4) + chr(0xC0 | b & 0x0F)
+	for b in xrange(256)
+]
+_RUN_PREFIXES = ['', ''] + [chr(0x80 | (c - 2)) for c in xrange(2, 66)]
+
+# Run-length decoding tables, indexed by byte value. Literal bytes map to
+# their characters, and run-length prefix bytes map to the lengths of their
+# runs.
+_CHARACTERS = [chr(b) for b in xrange(256)]
+_RUN_LENGTHS = [(b & 0x3F) + 2 for b in xrange(256)]
+
+# Strings up to this length are Burrows-Wheeler transformed by sorting their
+# suffixes with `sorted()` rather than by building a suffix array.
+_SORTED_SUFFIX_LIMIT = 2048
+
+
+def _suffixArray(text, size):
+	'''
+	Return the suffix array of `text`, a list of integers in `range(size)`
+	that ends with a unique 0 sentinel, using the SA-IS induced sorting
+	algorithm. (Nong, Zhang & Chan, "Linear Suffix Array Construction by
+	Almost Pure Induced-Sorting")
+	
+	Each suffix is classified as S-type if it is smaller than the suffix that
+	follows it, or L-type if it is larger. The leftmost S-type suffixes in
+	each run (LMS suffixes) are sorted first, and the order of every other
+	suffix is induced from them in two linear passes. If two LMS substrings
+	are identical, the LMS suffixes are sorted by recursing on the shorter
+	string of LMS substring names.
+	'''
+	n = len(text)
+	
+	if n == 1:
+		return [0]
+	
+	stype = [False] * n
+	stype[-1] = True
+	
+	for i in xrange(n - 2, -1, -1):
+		stype[i] = text[i] < text[i + 1] or (
+			text[i] == text[i + 1] and stype[i + 1]
+		)
+	
+	lms = [False] + [stype[i] and not stype[i - 1] for i in xrange(1, n)]
+	
+	# Every character's bucket in the suffix array starts where the bucket
+	# for the previous character ends.
+	counts = [0] * size
+	
+	for c in text:
+		counts[c] += 1
+	
+	heads = [0] * size
+	tails = [0] * size
+	total = 0
+	
+	for c in xrange(size):
+		heads[c] = total
+		total += counts[c]
+		tails[c] = total
+	
+	def induce(positions):
+		sa = [-1] * n
+		tail = tails[:]
+		
+		for i in reversed(positions):
+			c = text[i]
+			tail[c] -= 1
+			sa[tail[c]] = i
+		
+		head = heads[:]
+		
+		for k in xrange(n):
+			j = sa[k] - 1
+			
+			if j >= 0 and not stype[j]:
+				c = text[j]
+				sa[head[c]] = j
+				head[c] += 1
+		
+		tail = tails[:]
+		
+		for k in xrange(n - 1, -1, -1):
+			j = sa[k] - 1
+			
+			if j >= 0 and stype[j]:
+				c = text[j]
+				tail[c] -= 1
+				sa[tail[c]] = j
+		
+		return sa
+	
+	def equalSubstrings(a, b):
+		# Two LMS substrings are equal if they have the same characters and
+		# types up to and including the next LMS position.
+		k = 0
+		
+		while True:
+			if text[a + k] != text[b + k] or stype[a + k] != stype[b + k]:
+				return False
+			
+			k += 1
+			
+			if lms[a + k]:
+				return lms[b + k] and text[a + k] == text[b + k]
+	
+	positions = [i for i in xrange(n) if lms[i]]
+	sa = induce(positions)
+	
+	# Name each LMS substring by its rank among the sorted LMS substrings.
+	names = [-1] * n
+	name = 0
+	prev = None
+	
+	for i in sa:
+		if not lms[i]:
+			continue
+		
+		if prev is not None and (
+			prev == n - 1 or not equalSubstrings(prev, i)
+		):
+			name += 1
+		
+		names[i] = name
+		prev = i
+	
+	reduced = [names[i] for i in positions]
+	
+	if name + 1 == len(reduced):
+		# Every name is unique, so the names sort the LMS suffixes directly.
+		order = [0] * len(reduced)
+		
+		for i, r in enumerate(reduced):
+			order[r] = i
+	else:
+		order = _suffixArray(reduced, name + 1)
+	
+	return induce([positions[i] for i in order])
+
+
+def _lastColumn(string):
+	'''
+	Return the byte values of the Burrows-Wheeler transform of `string`, as a
+	sequence of integers that can be fed straight to the run-length encoder.
+	'''
+	assert '\0' not in string, "Input string cannot contain nul character ('\0')"
+	string += '\0'
+	
+	if len(string) <= 2:
+		# There's nothing to sort: the nul character is the first row, and
+		# whatever character precedes it ends the row.
+		return bytearray(string)
+	
+	# Because the nul character is unique and sorts first, sorting the
+	# rotations of the string is the same as sorting its suffixes. The last
+	# character of each rotation is the one before its suffix.
+	if len(string) <= _SORTED_SUFFIX_LIMIT:
+		# Short strings are faster to sort by comparing their suffixes
+		# directly, even though the slices take quadratic space.
+		sa = sorted(xrange(len(string)), key=lambda i: string[i:])
+	else:
+		sa = _suffixArray(list(bytearray(string)), 256)
+	
+	# Rotating the string right by one puts the character before each suffix
+	# at that suffix's index, so `itemgetter` can gather the last column in a
+	# single call.
+	rotated = bytearray(string[-1] + string[:-1])
+	return itemgetter(*sa)(rotated)
+
+
+def _bwtEncode(string):
+	'''
+	Return a Burrows-Wheeler transform of the input string.
+	(http://en.wikipedia.org/wiki/Burrows-Wheeler_transform)
+	
+	A Burrows-Wheeler transform is a reversible transformation that sorts a
+	string so its characters are in lexicographic order. Conceptually, we
+	make a table of all rotations of the original string and sort the rows.
+	The transformed result is the sequence of final characters from each
+	row. Rather than building the table, we read the sorted order of the
+	rows from a suffix array, which takes linear time and space.
+	'''
+	return str(bytearray(_lastColumn(string)))
+
+
+def _bwtDecode(string):
+	'''
+	Return the original string from a Burrows-Wheeler transformed string.
+	
+	The transformed string is the last column of the sorted table of
+	rotations, and sorting it gives the first column. A stable sort keeps
+	equal characters in the same relative order in both columns, so the
+	k-th row of the first column is the row whose rotation starts one
+	character later than the rotation in row `order[k]`. Starting from the
+	row that begins with the nul character, we follow that mapping to
+	read the original string from left to right.
+	'''
+	if string.count('\0') != 1:
+		raise ValueError('Illegal string')
+	
+	order = sorted(xrange(len(string)), key=string.__getitem__)
+	decoded = []
+	append = decoded.append
+	i = order[0]
+	
+	for _ in xrange(len(string) - 1):
+		i = order[i]
+		append(string[i])
+	
+	return ''.join(decoded)
+
+
+def _rleEncodeBuffer(string):
+	'''Return the run-length encoding of `string` as a bytearray.'''
+	encoded = bytearray()
+	
+	def encode_run(byte, count):
+		char = _ENCODED_CHARACTERS[byte]
+		
+		if count <= 65:
+			return _RUN_PREFIXES[count] + char
+		
+		# Break up runs that are too long for a single prefix byte. What's
+		# left over is a shorter run, a bare literal, or nothing at all.
+		full, rest = divmod(count, 65)
+		run = (_RUN_PREFIXES[65] + char) * full
+		
+		if rest:
+			run += _RUN_PREFIXES[rest] + char
+		
+		return run
+	
+	if not string:
+		return encoded
+	
+	if isinstance(string, str):
+		string = bytearray(string)
+	
+	prev = string[0]
+	count = 0
+	
+	for byte in string:
+		if byte == prev:
+			count += 1
+		else:
+			encoded += encode_run(prev, count)
+			prev = byte
+			count = 1
+	
+	encoded += encode_run(prev, count)
+	return encoded
+
+
+def _rleEncode(string):
+	'''Return a run-length encoded string
+	
+	The input may be a byte string or a sequence of byte values.
+	
+	A single character in the range 0 - 127 (ASCII) is encoded as itself.
+	
+	Characters in the range from 128 - 255 are broken into two bytes. The
+	high-order bits are prefixed with the codeword '1110' and the low-
+	order bits are prefixed with the codeword '1100'.
+	
+	+---+---+---+---+---+---+---+---+ +---+---+---+---+---+---+---+---+
+	| 1 | 1 | 1 | 0 | . | . | . | . | | 1 | 1 | 0 | 0 | . | . | . | . |
+	+---+---+---+---+---+---+---+---+ +---+---+---+---+---+---+---+---+
+	
+	Therefore, the byte '10110111' would be encoded as '11101011 11000111'
+	
+	Runs of two through 65 characters are encoded as above, with a prefix
+	byte that identifies the length of the run. A run length byte itself
+	is prefixed with the codeword '10'. Since runs of length zero or one
+	are not possible, we subtract 2 from the run length before encoding
+	the byte.
+	
+	+---+---+---+---+---+---+---+---+
+	| 1 | 0 | . | . | . | . | . | . |
+	+---+---+---+---+---+---+---+---+
+	
+	Therefore, a run of length 26 would be encoded as '10011000'. Runs
+	longer than 65 characters are split into several runs.
+	'''
+	return str(_rleEncodeBuffer(string))
+
+
+def _rleDecode(string):
+	'''Return the expanded form of a run-length encoded string'''
+	
+	decoded = bytearray()
+	temp = 0
+	length = 1
+	
+	# Local names are faster to look up than globals in the loop below.
+	characters = _CHARACTERS
+	runLengths = _RUN_LENGTHS
+	
+	# Iterating over a bytearray yields integers, so there's no need to
+	# call ord() on each character. The tests are ordered from the most
+	# to the least common kind of byte.
+	for byte in bytearray(string):
+		if byte < 0x80:
+			# byte is a single character.
+			decoded += characters[byte] * length
+			length = 1
+		elif byte < 0xC0:
+			# byte is an encoded run length. We only encode runs of more
+			# than two characters, so we decode the value by adding two
+			# to the value in the lowest six bits of the masked byte.
+			length = runLengths[byte]
+		elif byte < 0xD0:
+			# byte is the low-order half of a character in the range
+			# 128 - 255. The high-order half is in a temporary variable.
+			# Bitwise or the remaining bits onto the variable and append
+			# the character value onto the string.
+			temp |= byte & 0x0F
+			decoded += characters[temp] * length
+			length = 1
+		elif 0xE0 <= byte < 0xF0:
+			# byte is the high-order half of a character in the range
+			# 128 - 255. Bitshift the lowest four bytes of byte and
+			# place it in a temporary variable.
+			temp = (byte & 0x0F) << 4
+		else:
+			raise ValueError('Illegal string')
+	
+	return str(decoded)
+
+
+def _compress(string):
+	'''
+	Return the run-length encoded Burrows-Wheeler transform of `string` as a
+	bytearray.
+	'''
+	# The transform and the run-length encoder work on byte strings.
+	# Converting any other buffer once here also ensures the caller's
+	# bytearray is never modified by the transform.
+	if not isinstance(string, str):
+		string = str(bytearray(string))
+	
+	# The run-length encoder reads the transformed bytes directly, so the
+	# transform is never assembled into an intermediate string.
+	return _rleEncodeBuffer(_lastColumn(string))
+
+
+# Squash only ever extends `Base64`, so the base implementations are looked
+# up once rather than through `super()` on every call.
+_base64DecodeFunc = Base64.decode.im_func
+_base64EncodeFunc = Base64.encode.im_func
+
 
 class Squash(Base64):
 	@classmethod
 	def decode(clz, string):
-		return clz.decompress(super(Squash, clz).decode(string))
+		return clz.decompress(_base64DecodeFunc(clz, string))
 	
 	@classmethod
 	def encode(clz, byteString):
-		return super(Squash, clz).encode(clz.compress(byteString))
+		# The Base64 encoder reads the compressed bytearray directly, so it
+		# isn't copied into a string first.
+		return _base64EncodeFunc(clz, _compress(byteString))
+	
+	@classmethod
+	def iterEncode(clz, byteString, **kwargs):
+		# The compressed string depends on the whole input, so it can't be
+		# encoded a chunk at a time.
+		yield clz.encode(byteString)
 	
 	@classmethod
 	def compress(clz, string):
@@ -15,7 +378,7 @@ class Squash(Base64):
 		Return a compressed ASCII string by run-length encoding a Burrows-
 		Wheeler transform of the input string.
 		'''
-		return clz._rle_encode(clz._bwt_encode(string))
+		return str(_compress(string))
 	
 	@classmethod
 	def decompress(clz, bytes):
@@ -23,140 +386,11 @@ class Squash(Base64):
 		Return a decompressed ASCII string by reconstructing a run-length
 		encoded and B-W transformed bytestring.
 		'''
-		return clz._bwt_decode(clz._rle_decode(bytes))
+		return _bwtDecode(_rleDecode(bytes))
 	
-	@staticmethod
-	def _bwt_encode(string):
-		'''
-		Return a Burrows-Wheeler transform of the input string.
-		(http://en.wikipedia.org/wiki/Burrows–Wheeler_transform)
-		
-		A Burrows-Wheeler transform is a reversible transformation that sorts a
-		string so its characters are in lexicographic order. We make a table of
-		all rotations of the original string and sort the rows. The transformed
-		result is the sequence of final characters from each row.
-		'''
-		assert '\0' not in string, "Input string cannot contain nul character ('\0')"
-		string += '\0'
-		table = [string[i:] + string[:i] for i in range(len(string))]
-		table.sort()
-		return ''.join([row[-1:] for row in table])
-	
-	@staticmethod
-	def _bwt_decode(string):
-		'''
-		Return the original string from a Burrows-Wheeler transformed string.
-		'''
-		# Naive implementation
-		table = [''] * len(string)
-		for i in range(len(string)):
-			table = [string[i] + table[i] for i in range(len(string))]
-			table.sort()
-		s = [row for row in table if row.endswith('\0')][0]
-		return s.rstrip('\0')
-	
-	@staticmethod
-	def _rle_encode(string):
-		'''Return a run-length encoded string
-		
-		A single character in the range 0 - 127 (ASCII) is encoded as itself.
-		
-		Characters in the range from 128 - 255 are broken into two bytes. The
-		high-order bits are prefixed with the codeword '1110' and the low-
-		order bits are prefixed with the codeword '1100'.
-		
-		+---+---+---+---+---+---+---+---+ +---+---+---+---+---+---+---+---+
-		| 1 | 1 | 1 | 0 | . | . | . | . | | 1 | 1 | 0 | 0 | . | . | . | . |
-		+---+---+---+---+---+---+---+---+ +---+---+---+---+---+---+---+---+
-		
-		Therefore, the byte '10110111' would be encoded as '11101011 11000111'
-		
-		Runs of two through 65 characters are encoded as above, with a prefix
-		byte that identifies the length of the run. A run length byte itself
-		is prefixed with the codeword '10'. Since runs of length zero or one
-		are not possible, we subtract 2 from the run length before encoding
-		the byte.
-		
-		+---+---+---+---+---+---+---+---+
-		| 1 | 0 | . | . | . | . | . | . |
-		+---+---+---+---+---+---+---+---+
-		
-		Therefore, a run of length 26 would be encoded as '10011000'.
-		'''
-		
-		count = 1
-		prev = None
-		encoded = ''
-		
-		def encode_run(char, count):
-			if ord(char) >= 127:
-				high, low = ((ord(char) & 0xF0) >> 4, ord(char) & 0x0F)
-				enc = chr(0xE0 | 0x0F & high) + chr(0xC0 | 0x0F & low)
-			else:
-				enc = char
-			
-			if count == 1:
-				return enc
-			else:
-				return chr(0x80 | (count - 2)) + enc
-		
-		for ch in string:
-			if prev == None:
-				prev = ch
-				continue
-			elif prev == ch:
-				count += 1
-			
-			if ch != prev or count == 65:
-				encoded += encode_run(prev, count)
-				count = 1
-				prev = ch
-		
-		encoded += encode_run(prev, count)
-		return encoded
-	
-	@staticmethod
-	def _rle_decode(string):
-		'''Return the expanded form of a run-length encoded string'''
-		
-		decoded = ''
-		temp = 0
-		length = 0
-		
-		for ch in string:
-			byte = ord(ch)
-			if byte & 0x80 == 0x00:
-				# ch is a single character.
-				if length == 0:
-					decoded += ch
-				else:
-					decoded += ch * length
-				
-				length = 0
-			elif byte & 0xF0 == 0xE0:
-				# ch is the high-order half of a character in the range
-				# 128 - 255. Bitshift the lowest four bytes of ch and
-				# place it in a temporary variable.
-				temp = ((byte & 0x0F) << 4)
-			elif byte & 0xF0 == 0xC0:
-				# ch is the low-order half of a character in the range
-				# 128 - 255. The high-order half is in a temporary variable.
-				# Bitwise or the remaining bits onto the variable and append
-				# the character value onto the string.
-				temp |= byte & 0x0F
-				
-				if length == 0:
-					decoded += chr(temp)
-				else:
-					decoded += chr(temp) * length
-				
-				length = 0
-			elif byte & 0xC0 == 0x80:
-				# ch is an encoded run length. We only encode runs of more
-				# than two characters, so we decode the value by adding two
-				# to the value in the lowest six bits of the masked byte.
-				length = (byte & 0x4F) + 2
-			else:
-				raise ValueError('Illegal string')
-		
-		return decoded
+	# The transform and run-length coding stages are plain functions, so the
+	# methods above can call them directly. They're also available here.
+	_bwt_encode = staticmethod(_bwtEncode)
+	_bwt_decode = staticmethod(_bwtDecode)
+	_rle_encode = staticmethod(_rleEncode)
+	_rle_decode = staticmethod(_rleDecode)